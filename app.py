@@ -1,15 +1,22 @@
 import os
 import io
 import re
-import json
+import copy
+import asyncio
+import hashlib
 import traceback
-import requests
-from typing import Dict, Any
-from PIL import Image
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, Dict, Any, Iterator, List, Optional, Set, Tuple
+import httpx
+import orjson
+import msgspec
+from cachetools import TTLCache
+from PIL import Image, ImageOps
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import google.generativeai as genai
+from google.generativeai.client import get_default_generative_async_client
 
 # === Load API Keys from Environment ===
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -24,8 +31,139 @@ if not all([GOOGLE_API_KEY, CSE_API_KEY, CSE_ID]):
 genai.configure(api_key=GOOGLE_API_KEY)
 gemini_model = genai.GenerativeModel("gemini-1.5-flash")
 
+# Fixed extraction instructions are bound to the model once as its system
+# instruction, so each extraction request only carries the image.
+EXTRACTION_PROMPT = """
+Read the handwritten prescription and extract:
+- Medicine names
+- Dosages (e.g., 0-1-0, or 500mg 2x daily)
+- Taking time (e.g., morning, afternoon, night)
+- Diagnoses or reasons (if mentioned)
+- Benefits of using these drugs
+- Do's and Don'ts
+- Possible conditions
+
+Return strictly in JSON format:
+{
+  "drugs": [
+    {"name": "DrugA", "dosage": "0-1-0", "taking_time": "morning"},
+    {"name": "DrugB", "dosage": "500mg 2x daily", "taking_time": "night"}
+  ],
+  "diagnosis": "...",
+  "benefits": "...",
+  "dos_donts": "...",
+  "possible_conditions": "..."
+}
+"""
+# Structured output makes Gemini return bare JSON matching this shape
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "drugs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "dosage": {"type": "string"},
+                    "taking_time": {"type": "string"},
+                },
+                "required": ["name", "dosage", "taking_time"],
+            },
+        },
+        "diagnosis": {"type": "string"},
+        "benefits": {"type": "string"},
+        "dos_donts": {"type": "string"},
+        "possible_conditions": {"type": "string"},
+    },
+    "required": ["drugs"],
+}
+VALIDATION_SCHEMA = {"type": "array", "items": {"type": "boolean"}}
+
+extraction_model = genai.GenerativeModel(
+    "gemini-1.5-flash",
+    system_instruction=EXTRACTION_PROMPT,
+    generation_config={"response_mime_type": "application/json", "response_schema": EXTRACTION_SCHEMA},
+)
+
+# === Outbound Request Limits ===
+CSE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+HTTP_TIMEOUT = 10.0
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=100)
+# Each upstream API gets its own cap so one can't starve the other's rate limit.
+# Semaphores are per process, so the app-wide caps are split across uvicorn workers
+# (WEB_CONCURRENCY, as set by the Procfile).
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+CSE_CONCURRENCY = 10
+GEMINI_CONCURRENCY = 5
+cse_semaphore = asyncio.Semaphore(max(1, CSE_CONCURRENCY // WORKER_COUNT))
+gemini_semaphore = asyncio.Semaphore(max(1, GEMINI_CONCURRENCY // WORKER_COUNT))
+
+# === Result Caches ===
+# All caches, ETag revalidation and lookup coalescing below live in one worker
+# process; with several workers a repeat only hits when it lands on the same one.
+# Drug name -> validated image URL; these mappings are near-static
+DRUG_CACHE = TTLCache(maxsize=10_000, ttl=86400)
+# Candidate image URL -> capsule verdict; CSE usually returns the same top link per drug
+VALIDATION_CACHE = TTLCache(maxsize=50_000, ttl=7 * 86400)
+# Only byte-identical uploads are reused. Near-duplicate photo matching is ruled
+# out: it can't tell apart prescriptions that differ in a single dosage digit.
+# BLAKE2b digest of uploaded image bytes -> Gemini extraction result
+OCR_CACHE = TTLCache(maxsize=1000, ttl=3600)
+# Same digest -> full /extract response data; responses stored here carry it as their ETag
+RESULT_CACHE = TTLCache(maxsize=1000, ttl=3600)
+cache_lock = asyncio.Lock()
+# Normalized drug name -> lookup currently running in this worker
+INFLIGHT: Dict[str, asyncio.Future] = {}
+# Strong references keep detached lookup tasks from being garbage collected
+LOOKUP_TASKS: Set[asyncio.Task] = set()
+
+# === Shared Upstream Clients ===
+async def warm_up_connections(client: httpx.AsyncClient) -> None:
+    # Open the TLS/HTTP2 and gRPC connections before the first real request.
+    # Both calls are free: a keyless CSE request is rejected without using quota,
+    # and token counting isn't billed.
+    # Bounded so a silently dropping network can't stall worker startup
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                client.get(CSE_SEARCH_URL),
+                extraction_model.count_tokens_async(["ping"]),
+                return_exceptions=True,
+            ),
+            HTTP_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        print(f"[Warm-up Error] Timed out after {HTTP_TIMEOUT}s")
+        return
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"[Warm-up Error] {result}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http = httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    # Build the SDK's process-wide async client on this worker's loop up front;
+    # every model shares it, so all Gemini calls multiplex over one gRPC channel
+    get_default_generative_async_client()
+    await warm_up_connections(app.state.http)
+    try:
+        yield
+    finally:
+        # Detached lookups still hold the HTTP client; stop them before closing it
+        for task in LOOKUP_TASKS:
+            task.cancel()
+        await asyncio.gather(*LOOKUP_TASKS, return_exceptions=True)
+        await app.state.http.aclose()
+
+# === JSON Responses ===
+class OrjsonResponse(JSONResponse):
+    # Serializes with orjson; FastAPI's own ORJSONResponse is deprecated
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
 # === Initialize FastAPI App ===
-app = FastAPI(title="MediSnap OCR API", description="AI-powered prescription reader")
+app = FastAPI(title="MediSnap OCR API", description="AI-powered prescription reader", lifespan=lifespan, default_response_class=OrjsonResponse)
 
 # === Enable CORS ===
 app.add_middleware(
@@ -36,109 +174,332 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# === Response Parsing ===
+# Pull the JSON payload out of replies wrapped in markdown fences or prose
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+_JSON_LIST_RE = re.compile(r"\[.*\]", re.DOTALL)
+# Decodes validation verdicts straight into a typed list, rejecting anything else
+_VERDICTS_DECODER = msgspec.json.Decoder(List[bool])
+
+# === Image Preparation ===
+# Gemini gains nothing from detail beyond ~1024px, so uploads are shrunk and sent as
+# JPEG rather than letting the SDK re-encode the full photo as lossless WebP.
+MAX_IMAGE_EDGE = 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def encode_for_gemini(image: Image.Image) -> Dict[str, Any]:
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=85, optimize=True)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
+
+def decode_image(fileobj: BinaryIO) -> Image.Image:
+    # Forces a full decode so callers can run the codec work in a worker thread
+    image = Image.open(fileobj)
+    image.load()
+    return image
+
+def prepare_candidate_image(content: bytes) -> Dict[str, Any]:
+    return encode_for_gemini(decode_image(io.BytesIO(content)))
+
 # === Step 1: Gemini Extraction ===
-def extract_data_from_image(image: Image.Image) -> Dict[str, Any]:
-    prompt = """
-    Read the handwritten prescription and extract:
-    - Medicine names
-    - Dosages (e.g., 0-1-0, or 500mg 2x daily)
-    - Taking time (e.g., morning, afternoon, night)
-    - Diagnoses or reasons (if mentioned)
-    - Benefits of using these drugs
-    - Do's and Don'ts
-    - Possible conditions
-
-    Return strictly in JSON format:
-    {
-      "drugs": [
-        {"name": "DrugA", "dosage": "0-1-0", "taking_time": "morning"},
-        {"name": "DrugB", "dosage": "500mg 2x daily", "taking_time": "night"}
-      ],
-      "diagnosis": "...",
-      "benefits": "...",
-      "dos_donts": "...",
-      "possible_conditions": "..."
-    }
-    """
-    response = gemini_model.generate_content([prompt, image])
+async def extract_data_from_image(image: Dict[str, Any]) -> Dict[str, Any]:
+    async with gemini_semaphore:
+        response = await extraction_model.generate_content_async([image])
     text = response.text.strip()
     print("[Gemini Raw Response]\n", text)
 
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        match = re.search(r'\{.*\}', text, re.DOTALL)
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # Shouldn't happen with structured output; kept as a safety net
+        print("[Gemini JSON Fallback] Response was not bare JSON")
+        match = _JSON_RE.search(text)
         if match:
             try:
-                return json.loads(match.group())
-            except json.JSONDecodeError:
+                return orjson.loads(match.group())
+            except orjson.JSONDecodeError:
                 pass
         raise ValueError("Failed to parse Gemini response as JSON")
 
-# === Step 2: Validate Capsule Image ===
-def is_valid_capsule_image(image_url: str) -> bool:
+# === Step 2: Validate Capsule Images ===
+async def validate_capsule_images(images: List[Dict[str, Any]]) -> List[Optional[bool]]:
+    # One Gemini call judges every candidate image instead of one call per drug;
+    # None marks images that couldn't be judged
+    if not images:
+        return []
     try:
-        response = requests.get(image_url, timeout=10)
-        img = Image.open(io.BytesIO(response.content))
-
-        prompt = "Is this image a medicine capsule, tablet, or drug package? Answer only 'yes' or 'no'."
-        check = gemini_model.generate_content([prompt, img])
-        verdict = check.text.strip().lower()
-        return "yes" in verdict
+        prompt = (
+            f"For each of the following {len(images)} images, answer whether it shows a medicine "
+            "capsule, tablet, or drug package. Return only a JSON list of booleans, in order."
+        )
+        async with gemini_semaphore:
+            check = await gemini_model.generate_content_async(
+                [prompt, *images],
+                generation_config={"response_mime_type": "application/json", "response_schema": VALIDATION_SCHEMA},
+            )
+        text = check.text.strip()
+        match = _JSON_LIST_RE.search(text)
+        verdicts = _VERDICTS_DECODER.decode(match.group() if match else text)
+        if len(verdicts) != len(images):
+            raise ValueError(f"Expected {len(images)} verdicts, got: {text}")
+        return verdicts
     except Exception as e:
         print(f"[Validation Error] {e}")
-        return False
+        return [None] * len(images)
+
+# === Step 3: Fetch Drug Image URLs ===
+async def search_drug_image(client: httpx.AsyncClient, drug_name: str) -> Tuple[bool, Optional[str]]:
+    # Returns (searched, image_url): a search that completed with no results is
+    # (True, None), while quota, network and server errors are (False, None)
+    async with cse_semaphore:
+        try:
+            params = {
+                "q": f"{drug_name} medicine capsule",
+                "cx": CSE_ID,
+                "key": CSE_API_KEY,
+                "searchType": "image",
+                "num": 1,
+                "safe": "active",
+                # Only the link is used, so skip the rest of the result metadata
+                "fields": "items(link)"
+            }
+            response = await client.get(CSE_SEARCH_URL, params=params)
+            response.raise_for_status()
+            # With `fields`, a search with no results comes back as an empty object
+            items = orjson.loads(response.content).get("items")
+            return True, items[0]["link"] if items else None
+        except httpx.HTTPStatusError as e:
+            # The error message includes the request URL, which carries the API key
+            print(f"[Image Search Error] {drug_name}: HTTP {e.response.status_code}")
+            return False, None
+        except Exception as e:
+            print(f"[Image Search Error] {drug_name}: {e}")
+            return False, None
 
-# === Step 3: Fetch Drug Image URL ===
-def get_drug_image_url(drug_name: str) -> str:
+async def download_image(client: httpx.AsyncClient, image_url: str) -> Optional[Dict[str, Any]]:
     try:
-        search_url = "https://www.googleapis.com/customsearch/v1"
-        params = {
-            "q": f"{drug_name} medicine capsule",
-            "cx": CSE_ID,
-            "key": CSE_API_KEY,
-            "searchType": "image",
-            "num": 1
-        }
-        response = requests.get(search_url, params=params, timeout=10)
-        image_url = response.json()["items"][0]["link"]
-
-        if is_valid_capsule_image(image_url):
-            return image_url
-        else:
-            print(f"[Image Rejected] Not a capsule: {drug_name}")
-            return None
+        response = await client.get(image_url, follow_redirects=True)
+        # Decode and re-encode in a worker thread; handing PIL images to the SDK
+        # would re-encode them as full-size lossless WebP on the event loop
+        return await asyncio.to_thread(prepare_candidate_image, response.content)
     except Exception as e:
-        print(f"[Image Fetch Error] {drug_name}: {e}")
+        print(f"[Image Download Error] {image_url}: {e}")
         return None
 
+async def fetch_candidate_image(
+    client: httpx.AsyncClient, drug_name: str
+) -> Tuple[bool, Optional[str], Optional[bool], Optional[Dict[str, Any]]]:
+    # Returns (searched, image_url, cached_verdict, image). Each drug moves on to its
+    # download as soon as its own search returns, so searches and downloads for
+    # different drugs overlap; URLs with a cached verdict aren't downloaded at all.
+    searched, image_url = await search_drug_image(client, drug_name)
+    if image_url is None:
+        return searched, None, None, None
+    cached_verdict = VALIDATION_CACHE.get(image_url)
+    if cached_verdict is not None:
+        return searched, image_url, cached_verdict, None
+    return searched, image_url, None, await download_image(client, image_url)
+
+async def lookup_uncached_drugs(client: httpx.AsyncClient, keys: List[str]) -> Dict[str, Optional[str]]:
+    # Returns only the drugs that reached a verdict: their image URL, or None if the
+    # search found nothing or the candidate was rejected. Failed searches, downloads
+    # and validations are left out.
+    candidates = await asyncio.gather(*(fetch_candidate_image(client, key) for key in keys))
+    verdicts: Dict[str, Optional[bool]] = {}
+    for _, url, verdict, _ in candidates:
+        # Two drugs can share a candidate URL; keep whichever verdict is known
+        if url is not None and verdicts.get(url) is None:
+            verdicts[url] = verdict
+    fetched = [(url, img) for _, url, _, img in candidates if img is not None]
+    new_verdicts = await validate_capsule_images([img for _, img in fetched])
+    verdicts.update((url, verdict) for (url, _), verdict in zip(fetched, new_verdicts))
+
+    resolved = {}
+    for key, (searched, image_url, _, _) in zip(keys, candidates):
+        if image_url is None:
+            if searched:
+                resolved[key] = None
+            continue
+        if verdicts[image_url] is None:
+            continue
+        if verdicts[image_url]:
+            resolved[key] = image_url
+        else:
+            resolved[key] = None
+            print(f"[Image Rejected] Not a capsule: {key}")
+    async with cache_lock:
+        for key, image_url in resolved.items():
+            if image_url is not None:
+                DRUG_CACHE[key] = image_url
+        for image_url, verdict in verdicts.items():
+            if verdict is not None:
+                VALIDATION_CACHE[image_url] = verdict
+
+    return resolved
+
+async def resolve_lookups(client: httpx.AsyncClient, futures: Dict[str, asyncio.Future]) -> None:
+    # Runs as its own task rather than inside the request that started it, so a
+    # cancelled request can't cut short a lookup other requests are waiting on
+    resolved = {}
+    try:
+        resolved = await lookup_uncached_drugs(client, list(futures))
+    except Exception as e:
+        print(f"[Image Lookup Error] {e}")
+    finally:
+        for key, future in futures.items():
+            INFLIGHT.pop(key, None)
+            if not future.done():
+                future.set_result((key in resolved, resolved.get(key)))
+
+def normalize_drug_name(name: str) -> str:
+    return name.strip().lower()
+
+async def get_drug_image_urls(client: httpx.AsyncClient, drug_names: List[str]) -> Tuple[List[Optional[str]], bool]:
+    # Also reports whether every lookup reached a verdict, so results hit by a
+    # transient failure aren't cached
+    keys = [normalize_drug_name(name) for name in drug_names]
+    # One get() per key: a TTL entry can expire between an `in` check and indexing
+    cached = {key: DRUG_CACHE.get(key) for key in set(keys)}
+    resolved: Dict[str, Optional[str]] = {key: url for key, url in cached.items() if url is not None}
+    resolved.setdefault("", None)
+    pending = [key for key in dict.fromkeys(keys) if key not in resolved]
+
+    # Drugs another request is already looking up are awaited, not fetched twice
+    loop = asyncio.get_running_loop()
+    owned = {key: loop.create_future() for key in pending if key not in INFLIGHT}
+    if owned:
+        INFLIGHT.update(owned)
+        task = asyncio.create_task(resolve_lookups(client, owned))
+        LOOKUP_TASKS.add(task)
+        task.add_done_callback(LOOKUP_TASKS.discard)
+
+    futures = {key: INFLIGHT[key] for key in pending}
+    for key, future in futures.items():
+        # Shielded so a cancelled request doesn't cancel the lookup it shares
+        done, image_url = await asyncio.shield(future)
+        if done:
+            resolved[key] = image_url
+
+    return [resolved.get(key) for key in keys], all(key in resolved for key in keys)
+
 # === Step 4: FastAPI Endpoint ===
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+async def stream_extraction(extracted_data: Dict[str, Any], image_key: str) -> AsyncIterator[str]:
+    # OCR results go out immediately; drug images follow once their lookups finish
+    try:
+        yield sse_event({"phase": "ocr", "data": extracted_data})
+
+        # Drugs already cached go out right away instead of waiting on the batch
+        pending = []
+        for drug in extracted_data.get("drugs", []):
+            image_url = DRUG_CACHE.get(normalize_drug_name(drug.get("name", "")))
+            if image_url is None:
+                pending.append(drug)
+                continue
+            drug["image_url"] = image_url
+            yield sse_event({"phase": "drug", "name": drug.get("name", ""), "image_url": image_url})
+
+        image_urls, complete = await get_drug_image_urls(app.state.http, [drug.get("name", "") for drug in pending])
+        for drug, image_url in zip(pending, image_urls):
+            drug["image_url"] = image_url or "Not found"
+            yield sse_event({"phase": "drug", "name": drug.get("name", ""), "image_url": drug["image_url"]})
+
+        if complete:
+            async with cache_lock:
+                RESULT_CACHE[image_key] = extracted_data
+        yield sse_event({"phase": "done"})
+    except Exception:
+        print("[Server Error]\n", traceback.format_exc())
+        yield sse_event({"phase": "error", "message": "Failed to fetch drug images"})
+
+def replay_extraction(result: Dict[str, Any]) -> Iterator[str]:
+    # Same event sequence as stream_extraction, built from a cached response
+    drugs = result.get("drugs", [])
+    ocr_data = {**result, "drugs": [{k: v for k, v in drug.items() if k != "image_url"} for drug in drugs]}
+    yield sse_event({"phase": "ocr", "data": ocr_data})
+    for drug in drugs:
+        yield sse_event({"phase": "drug", "name": drug.get("name", ""), "image_url": drug["image_url"]})
+    yield sse_event({"phase": "done"})
+
 @app.post("/extract")
-async def extract_prescription(file: UploadFile = File(...)):
+async def extract_prescription(request: Request, file: UploadFile = File(...)):
     try:
-        # Load image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
+        # Hash the upload in chunks rather than buffering it whole
+        digest = hashlib.blake2b(digest_size=16)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+        image_key = digest.hexdigest()
+        etag = f'"{image_key}"'
+        # Clients that accept an event stream get partial results as they're ready
+        streaming = "text/event-stream" in request.headers.get("accept", "")
 
-        # Step 1: Extract drug info
-        extracted_data = extract_data_from_image(image)
+        # Repeat submissions of the same file skip the whole pipeline
+        cached_result = RESULT_CACHE.get(image_key)
+        if cached_result is not None:
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            if streaming:
+                return StreamingResponse(
+                    replay_extraction(cached_result),
+                    media_type="text/event-stream",
+                    headers={"ETag": etag, "Cache-Control": "no-cache"},
+                )
+            return OrjsonResponse(content={"status": "success", "data": cached_result}, headers={"ETag": etag})
 
-        # Step 2: Add capsule image URLs if valid
-        for drug in extracted_data.get("drugs", []):
-            name = drug.get("name", "")
-            drug["image_url"] = get_drug_image_url(name) or "Not found"
+        # Step 1: Extract drug info (reuse earlier extraction of the same upload)
+        cached = OCR_CACHE.get(image_key)
+        if cached is not None:
+            extracted_data = copy.deepcopy(cached)
+        else:
+            await file.seek(0)
+            # Decode straight from the spooled upload file instead of a bytes copy of it
+            image = await asyncio.to_thread(decode_image, file.file)
+            image_blob = await asyncio.to_thread(encode_for_gemini, image)
+            extracted_data = await extract_data_from_image(image_blob)
+            async with cache_lock:
+                OCR_CACHE[image_key] = copy.deepcopy(extracted_data)
 
         # Ensure all expected keys exist
         for key in ["diagnosis", "benefits", "dos_donts", "possible_conditions"]:
             if key not in extracted_data:
                 extracted_data[key] = None
 
-        return JSONResponse(content={"status": "success", "data": extracted_data})
+        if streaming:
+            return StreamingResponse(
+                stream_extraction(extracted_data, image_key),
+                media_type="text/event-stream",
+                # No ETag: headers go out before we know whether the result gets cached
+                headers={"Cache-Control": "no-cache"},
+            )
+
+        # Step 2: Add capsule image URLs if valid (all drugs looked up concurrently)
+        drugs = extracted_data.get("drugs", [])
+        image_urls, complete = await get_drug_image_urls(app.state.http, [drug.get("name", "") for drug in drugs])
+        for drug, image_url in zip(drugs, image_urls):
+            drug["image_url"] = image_url or "Not found"
+
+        # Only responses stored in RESULT_CACHE carry the ETag, so a 304 never
+        # confirms a body that had unresolved drug lookups
+        if not complete:
+            return OrjsonResponse(content={"status": "success", "data": extracted_data})
+        async with cache_lock:
+            RESULT_CACHE[image_key] = extracted_data
+        return OrjsonResponse(content={"status": "success", "data": extracted_data}, headers={"ETag": etag})
 
     except Exception as e:
         stack = traceback.format_exc()
         print("[Server Error]\n", stack)
-        return JSONResponse(
+        return OrjsonResponse(
             status_code=500,
             content={
                 "status": "error",